@@ -0,0 +1,69 @@
+"""
+AWS client helpers shared by the photo Lambdas (LF1 indexing, LF2 search).
+
+backend/package.sh copies this module into each function's deployment zip.
+"""
+import logging
+import os
+import orjson
+from botocore.config import Config
+from botocore.credentials import Credentials
+from opensearchpy import OpenSearch, Urllib3HttpConnection, Urllib3AWSV4SignerAuth
+from opensearchpy.exceptions import SerializationError
+from opensearchpy.serializer import JSONSerializer
+
+logger = logging.getLogger()
+
+# Larger keep-alive pool so fan-out and warm invocations reuse sockets instead of reconnecting
+BOTO_CONFIG = Config(max_pool_connections=50, retries={'max_attempts': 3, 'mode': 'adaptive'}, tcp_keepalive=True)
+
+
+class OrjsonSerializer(JSONSerializer):
+    """JSONSerializer that encodes/decodes request and response bodies with orjson."""
+
+    def loads(self, s):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        # don't serialize strings or bytes (already-encoded bodies)
+        if isinstance(data, (str, bytes)):
+            return data
+        try:
+            # helpers.bulk measures chunk sizes on str, so hand back text
+            return orjson.dumps(data, default=self.default).decode('utf-8')
+        except orjson.JSONEncodeError as e:
+            raise SerializationError(data, e)
+
+
+def env_credentials():
+    """
+    Lambda always exports the role credentials as environment variables, so read them
+    directly instead of running botocore's full credential resolver chain.
+    """
+    return Credentials(
+        os.environ['AWS_ACCESS_KEY_ID'],
+        os.environ['AWS_SECRET_ACCESS_KEY'],
+        os.environ.get('AWS_SESSION_TOKEN')
+    )
+
+
+def build_opensearch_client(host, region):
+    """
+    Builds a SigV4-signed OpenSearch client and pings it, so the TLS connection is
+    opened during INIT and the first invocation only does I/O.
+    """
+    client = OpenSearch(
+        hosts=[{'host': host, 'port': 443}],
+        http_auth=Urllib3AWSV4SignerAuth(env_credentials(), region, 'es'),
+        use_ssl=True,
+        verify_certs=True,
+        connection_class=Urllib3HttpConnection,
+        pool_maxsize=20,
+        serializer=OrjsonSerializer()
+    )
+    if not client.ping():
+        logger.warning(f"OpenSearch warm-up ping to {host} failed")
+    return client
@@ -3,70 +3,72 @@ import logging
 import urllib.parse
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
 # --- External Library Dependency (Must be packaged in .zip file) ---
-# Requires 'requests' and 'requests-aws4auth' in the deployment package.
-import requests
-from requests_aws4auth import AWS4Auth
+# Requires 'opensearch-py' and 'orjson' in the deployment package, plus the shared
+# aws_clients module (backend/package.sh copies it in).
+from opensearchpy import helpers
 # ------------------------------------------------------------------
 
 import boto3
+from aws_clients import BOTO_CONFIG, build_opensearch_client
 
 # Set up logging
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 # Environment variables are required for configuration
 OPENSEARCH_HOST = os.environ.get('OPENSEARCH_HOST')
 REGION = os.environ.get('AWS_REGION')
 INDEX_NAME = 'photos' # Required index name
+# Skip Rekognition once an upload carries at least this many custom labels (0 disables)
+CUSTOM_LABELS_SKIP_REKOGNITION = int(os.environ.get('CUSTOM_LABELS_SKIP_REKOGNITION', '0'))
+# Honour the uploader's x-amz-meta-skipRekog: 1 header (off by default)
+HONOR_SKIP_REKOG_HEADER = os.environ.get('HONOR_SKIP_REKOG_HEADER', 'false').lower() == 'true'
+# Only when a skip is possible does Rekognition have to wait for the metadata
+REKOGNITION_SKIPPABLE = CUSTOM_LABELS_SKIP_REKOGNITION > 0 or HONOR_SKIP_REKOG_HEADER
 
-# Initialize AWS V4 Signature authentication using the Lambda's IAM role credentials
+# Initialize a signed OpenSearch client using the Lambda's IAM role credentials.
+# Built once at import so its connection pool is reused across warm invocations.
 try:
-    credentials = boto3.Session().get_credentials()
-    awsauth = AWS4Auth(
-        credentials.access_key,
-        credentials.secret_key,
-        REGION,
-        'es',  # service name for OpenSearch (formerly ElasticSearch)
-        session_token=credentials.token
-    )
+    OS_CLIENT = build_opensearch_client(OPENSEARCH_HOST, REGION)
 except Exception as e:
-    logger.error(f"Failed to initialize AWS4Auth: {e}. Check IAM Role.")
-    awsauth = None # Will cause failure if not set
-
-def lambda_handler(event, context):
-    s3_client = boto3.client('s3')
-    rekognition_client = boto3.client('rekognition')
+    logger.error(f"Failed to initialize OpenSearch client: {e}. Check IAM Role.")
+    OS_CLIENT = None # Will cause failure if not set
 
-    logger.info(f"Received S3 PUT event: {json.dumps(event)}")
+# AWS client setup (outside handler so warm invocations reuse them)
+S3_CLIENT = boto3.client('s3', config=BOTO_CONFIG)
+REKOGNITION_CLIENT = boto3.client('rekognition', config=BOTO_CONFIG)
 
-    # 1. Extract event data (E1)
-    try:
-        record = event['Records'][0]
-        bucket = record['s3']['bucket']['name']
-        key = urllib.parse.unquote_plus(record['s3']['object']['key'])
-        
-        logger.info(f"Processing object: s3://{bucket}/{key}")
-    except Exception as e:
-        logger.error(f"Error extracting S3 details: {e}")
-        return {'statusCode': 400, 'body': json.dumps({'message': 'Invalid event'})}
+# Lookups run on workers so they overlap within a record and across a batched event
+EXEC = ThreadPoolExecutor(max_workers=4)
 
-    # 2. Retrieve custom labels (x-amz-meta-customLabels)
+def get_custom_labels(bucket, key):
+    """
+    Reads x-amz-meta-customLabels and the upload time from the object's metadata,
+    and whether the uploader opted out of Rekognition (x-amz-meta-skipRekog).
+    """
     custom_labels = []
+    skip_rekognition = False
     try:
         # Use headObject method to retrieve only metadata, not the file content
-        s3_head_object = s3_client.head_object(Bucket=bucket, Key=key)
+        s3_head_object = S3_CLIENT.head_object(Bucket=bucket, Key=key)
         
-        # S3 metadata keys are automatically lowercased
+        # boto3 strips the x-amz-meta- prefix and S3 lowercases user metadata keys
         metadata = s3_head_object.get('Metadata', {})
-        raw_labels = metadata.get('x-amz-meta-customlabels', '')
+        raw_labels = metadata.get('customlabels', '')
         
         if raw_labels:
             # Clean up and split the comma-separated string (A1)
             custom_labels = [label.strip().lower() for label in raw_labels.split(',') if label.strip()]
         
-        logger.info(f"Custom labels retrieved: {custom_labels}")
+        logger.info("Custom labels retrieved: %s", custom_labels)
+        skip_rekognition = (
+            (HONOR_SKIP_REKOG_HEADER and metadata.get('skiprekog') == '1')
+            or (CUSTOM_LABELS_SKIP_REKOGNITION > 0 and len(custom_labels) >= CUSTOM_LABELS_SKIP_REKOGNITION)
+        )
         created_timestamp = s3_head_object.get('LastModified', time.time()).isoformat()
 
     except Exception as e:
@@ -74,61 +76,134 @@ def lambda_handler(event, context):
         created_timestamp = time.time().isoformat()
         # Continue processing even if custom labels fail
 
-    # 3. Detect labels using Rekognition
-    rekognition_labels = []
-    try:
-        rekognition_response = rekognition_client.detect_labels(
-            Image={'S3Object': {'Bucket': bucket, 'Name': key}},
-            MaxLabels=20,
-            MinConfidence=75
-        )
-        
-        # Extract the label names and convert to lowercase for consistent searching
-        rekognition_labels = [
-            label['Name'].lower()
-            for label in rekognition_response['Labels']
-        ]
-        
-        logger.info(f"Rekognition labels detected: {rekognition_labels}")
+    return custom_labels, created_timestamp, skip_rekognition
+
+
+def detect_rekognition_labels(bucket, key):
+    """Detects labels using Rekognition. Raises if the call fails."""
+    rekognition_response = REKOGNITION_CLIENT.detect_labels(
+        Image={'S3Object': {'Bucket': bucket, 'Name': key}},
+        MaxLabels=20,
+        MinConfidence=75
+    )
+    
+    # Extract the label names and convert to lowercase for consistent searching
+    rekognition_labels = [
+        label['Name'].lower()
+        for label in rekognition_response['Labels']
+    ]
+    
+    logger.info("Rekognition labels detected: %s", rekognition_labels)
+    return rekognition_labels
+
+
+def lookup_labels(bucket, key):
+    """
+    Fetches the S3 metadata (2) and then, only if the custom labels don't already
+    describe the photo, the Rekognition labels (3). Raises if Rekognition fails.
+    """
+    custom_labels, created_timestamp, skip_rekognition = get_custom_labels(bucket, key)
+    if skip_rekognition:
+        logger.info(f"Skipping Rekognition for {key}; custom labels are sufficient.")
+        return custom_labels, created_timestamp, []
+    return custom_labels, created_timestamp, detect_rekognition_labels(bucket, key)
+
+
+def submit_lookups(bucket, key):
+    """
+    Starts the lookups for one object and returns a callable that waits for
+    (custom_labels, created_timestamp, rekognition_labels).
+    """
+    if REKOGNITION_SKIPPABLE:
+        # Rekognition may be skipped, so it has to wait for the metadata
+        return EXEC.submit(lookup_labels, bucket, key).result
 
+    # Nothing can skip Rekognition, so run head_object and detect_labels side by side
+    f_head = EXEC.submit(get_custom_labels, bucket, key)
+    f_rek = EXEC.submit(detect_rekognition_labels, bucket, key)
+    return lambda: f_head.result()[:2] + (f_rek.result(),)
+
+
+def build_document(bucket, key, collect):
+    """Builds the OpenSearch document for one S3 object, or None if Rekognition fails."""
+    try:
+        custom_labels, created_timestamp, rekognition_labels = collect()
     except Exception as e:
         logger.error(f"Error calling Rekognition. Check IAM permissions. Error: {e}")
-        return {'statusCode': 500, 'body': json.dumps({'message': 'Rekognition failed'})}
+        return None
 
-    # Combine all labels and remove duplicates (Case-insensitive)
-    all_labels = list(set(rekognition_labels + custom_labels))
+    # Combine all labels and remove duplicates (Case-insensitive, both lists are
+    # already lowercased). dict.fromkeys keeps Rekognition's confidence order.
+    all_labels = list(dict.fromkeys(chain(rekognition_labels, custom_labels)))
     
-    # 4. Index in OpenSearch
-    document = {
+    return {
         'objectKey': key,
         'bucket': bucket,
         'createdTimestamp': created_timestamp,
         'labels': all_labels # This is the field we will search against
     }
+
+
+def lambda_handler(event, context):
+    # %-style args defer formatting the (multi-KB) event until DEBUG is enabled
+    logger.debug("Received S3 PUT event: %s", event)
+
+    # 1. Extract event data (E1). S3 may deliver several records per invocation.
+    try:
+        objects = [
+            (record['s3']['bucket']['name'], urllib.parse.unquote_plus(record['s3']['object']['key']))
+            for record in event['Records']
+        ]
+    except Exception as e:
+        logger.error(f"Error extracting S3 details: {e}")
+        return {'statusCode': 400, 'body': json.dumps({'message': 'Invalid event'})}
+
+    # Fan out the lookups for every record before waiting on any of them
+    pending = []
+    for bucket, key in objects:
+        logger.info(f"Processing object: s3://{bucket}/{key}")
+        pending.append((bucket, key, submit_lookups(bucket, key)))
+
+    actions = []
+    failed = 0
+    for bucket, key, collect in pending:
+        document = build_document(bucket, key, collect)
+        if document is None:
+            failed += 1
+            continue
+        # Using the key as document ID so re-uploads update the existing document
+        actions.append({
+            '_op_type': 'index',
+            '_index': INDEX_NAME,
+            '_id': key.replace("/", "_"),
+            '_source': document
+        })
+
+    if not actions:
+        return {'statusCode': 500, 'body': json.dumps({'message': 'Rekognition failed'})}
     
-    # The OpenSearch URL for indexing is: host/index_name/_doc/document_id
-    opensearch_url = f'https://{OPENSEARCH_HOST}/{INDEX_NAME}/_doc/{key.replace("/", "_")}' # Using key as document ID
-    
-    if not awsauth:
-        logger.error("AWS4Auth is not initialized. Cannot connect to OpenSearch.")
+    # 4. Index in OpenSearch (one _bulk request for every record in the event)
+    if not OS_CLIENT:
+        logger.error("OpenSearch client is not initialized. Cannot connect to OpenSearch.")
         return {'statusCode': 500, 'body': json.dumps({'message': 'Authentication error'})}
     
     try:
-        # Send the signed request to OpenSearch
-        response = requests.put( # Using PUT to ensure the document is created or updated
-            opensearch_url,
-            auth=awsauth,
-            json=document,
-            headers={"Content-Type": "application/json"}
+        indexed, errors = helpers.bulk(
+            OS_CLIENT,
+            actions,
+            chunk_size=500,
+            max_chunk_bytes=100 * 1024 * 1024,
+            raise_on_error=False
         )
-        
-        if response.status_code in [200, 201]:
-            logger.info(f"Successfully indexed document for {key}.")
-            return {'statusCode': 200, 'body': json.dumps({'message': 'Photo indexed successfully'})}
-        else:
-            logger.error(f"Failed to index document. Status: {response.status_code}, Response: {response.text}")
-            return {'statusCode': response.status_code, 'body': json.dumps({'message': 'Failed to index photo in OpenSearch'})}
-
     except Exception as e:
         logger.error(f"OpenSearch connectivity error. Check network and access policy. Error: {e}")
-        return {'statusCode': 500, 'body': json.dumps({'message': 'OpenSearch indexing failed'})}
\ No newline at end of file
+        return {'statusCode': 500, 'body': json.dumps({'message': 'OpenSearch indexing failed'})}
+
+    if errors:
+        logger.error(f"Failed to index {len(errors)} document(s): {errors}")
+    failed += len(errors)
+    logger.info(f"Successfully indexed {indexed} document(s).")
+
+    if failed:
+        return {'statusCode': 500, 'body': json.dumps({'message': f'Failed to index {failed} of {len(objects)} photo(s)'})}
+    return {'statusCode': 200, 'body': json.dumps({'message': 'Photo indexed successfully'})}
\ No newline at end of file
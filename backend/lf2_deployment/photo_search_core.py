@@ -0,0 +1,148 @@
+"""
+Search logic for the LF2 Lambda: Lex keyword extraction and the OpenSearch label
+query. The Lex and OpenSearch clients are built once per container by search_clients().
+"""
+import boto3
+import time
+import uuid
+from functools import lru_cache
+import orjson
+from opensearchpy.exceptions import OpenSearchException
+
+from aws_clients import BOTO_CONFIG, build_opensearch_client, logger
+
+# --- Configuration ---
+# Update these placeholders with your actual values
+REGION = 'us-east-1' 
+ES_HOST = 'search-photos-eliyvit6bhto2sctejudtas4sm.us-east-1.es.amazonaws.com'
+ES_INDEX = 'photos'
+# These IDs are used to communicate with your Lex V2 Bot
+LEX_BOT_ID = 'S8YGIKNQ45'         
+LEX_BOT_ALIAS_ID = 'KYZRHAD1NL'    
+LEX_LOCALE_ID = 'en_US'
+LEX_CACHE_SIZE = 1024
+# Popular searches are served from an in-process cache for up to this many seconds
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TTL = 60
+# Pre-serialized body for the common single-keyword search; only the keyword is encoded
+_ONE_TERM_QUERY = b'{"query":{"bool":{"filter":{"term":{"labels":%s}}}},"_source":["objectKey"],"size":200}'
+# Keywords that never match a label on their own
+STOPWORDS = frozenset({'the', 'a', 'an', 'of', 'in', 'on', 'with', 'and'})
+
+
+@lru_cache(maxsize=None)
+def search_clients():
+    """Returns the (Lex, OpenSearch) clients for the search path, built once per container."""
+    return boto3.client('lexv2-runtime', config=BOTO_CONFIG), build_opensearch_client(ES_HOST, REGION)
+
+
+@lru_cache(maxsize=LEX_CACHE_SIZE)
+def _classify(query):
+    """
+    Runs Lex V2 NLU on a normalized query. Results are cached for the lifetime of
+    the warm container, so repeated queries skip Lex entirely. Each miss uses a
+    fresh session so concurrent users never share slot state.
+    """
+    lex_client, _ = search_clients()
+    return lex_client.recognize_text(
+        botId=LEX_BOT_ID,           
+        botAliasId=LEX_BOT_ALIAS_ID, 
+        localeId=LEX_LOCALE_ID,     
+        sessionId=uuid.uuid4().hex,       
+        text=query
+    )
+
+
+def get_keywords_from_lex(query):
+    """Calls Lex V2 to get keywords (slot values) from the user query."""
+    try:
+        response = _classify(query.strip().lower())
+        
+        # The full Lex response is large; only format it when DEBUG is enabled
+        logger.debug("Full Lex Response: %s", response)
+        
+        intent = response.get('sessionState', {}).get('intent', {})
+        intent_name = intent.get('name')
+        slots = intent.get('slots', {})
+        keywords = []
+
+        if intent_name == 'PhotoSearchIntent':
+            slot_name = 'Keywords' 
+            
+            if slots.get(slot_name):
+                slot_value_obj = slots[slot_name]['value']
+                logger.debug("Raw Slot Value: %s", slot_value_obj)
+                keyword_string = ""
+                
+                if slot_value_obj and slot_value_obj.get('interpretedValue'):
+                    keyword_string = slot_value_obj['interpretedValue'].lower()
+                    
+                elif slot_value_obj and slot_value_obj.get('originalValue'):
+                    keyword_string = slot_value_obj['originalValue'].lower()
+                
+                # Split the keyword string into a list
+                keywords = [k.strip() for k in keyword_string.split() if k.strip()] 
+            
+            logger.info(f"Extracted keywords: {keywords}")
+            return keywords
+        
+        else:
+            logger.info(f"Lex matched a different intent: {intent_name}")
+            return []
+
+    except Exception as e:
+        logger.error(f"Error calling Lex V2 Runtime: {e}")
+        return []
+
+
+@lru_cache(maxsize=SEARCH_CACHE_SIZE)
+def _run_search(keywords, ttl_bucket):
+    """
+    Runs the label query for a normalized keyword tuple. ttl_bucket is only part of
+    the cache key so entries expire every SEARCH_CACHE_TTL seconds. Errors propagate
+    so failed searches are never cached.
+    """
+    # Keywords are already lowercase tokens, so a 'terms' lookup on 'labels' skips
+    # query analysis. Filter context skips scoring and lets OpenSearch cache it.
+    if len(keywords) == 1:
+        # orjson escapes the keyword into a valid JSON string literal
+        query_body = _ONE_TERM_QUERY % orjson.dumps(keywords[0])
+    else:
+        query_body = {
+            "query": {
+                "bool": {
+                    "filter": {
+                        "terms": {
+                            "labels": list(keywords)
+                        }
+                    }
+                }
+            },
+            # Only return the S3 objectKey from the source
+            "_source": ["objectKey"],
+            "size": 200
+        }
+        
+    _, os_client = search_clients()
+    search_results = os_client.search(
+        index=ES_INDEX,
+        body=query_body
+    )
+    
+    # Extract the list of S3 object keys (e.g., "myphoto.jpg")
+    return tuple(hit['_source']['objectKey'] for hit in search_results.get('hits', {}).get('hits', []))
+
+
+def search_opensearch(keywords):
+    """
+    Searches the OpenSearch index for photo keys matching the labels/keywords.
+    """
+    if not keywords:
+        return []
+
+    try:
+        return list(_run_search(tuple(sorted(set(keywords))), int(time.time() // SEARCH_CACHE_TTL)))
+
+    except OpenSearchException as e:
+        logger.error(f"OpenSearch query failed: {e}")
+        return []
@@ -0,0 +1,28 @@
+#!/usr/bin/env bash
+# Builds the LF1/LF2 deployment zips (arm64, python3.9) into backend/dist/.
+# Each zip gets the function's own code, the shared modules from backend/common
+# and its requirements.txt dependencies.
+set -euo pipefail
+
+BACKEND_DIR="$(cd "$(dirname "$0")" && pwd)"
+BUILD_DIR="$BACKEND_DIR/build"
+DIST_DIR="$BACKEND_DIR/dist"
+
+rm -rf "$BUILD_DIR" "$DIST_DIR"
+mkdir -p "$DIST_DIR"
+
+for fn in lf1 lf2; do
+    src="$BACKEND_DIR/${fn}_deployment"
+    out="$BUILD_DIR/$fn"
+    mkdir -p "$out"
+
+    cp "$src"/*.py "$out"/
+    cp "$BACKEND_DIR"/common/*.py "$out"/
+
+    # orjson ships native wheels, so resolve them for the Lambda's arm64 runtime
+    pip install -q -r "$src/requirements.txt" -t "$out" \
+        --platform manylinux2014_aarch64 --python-version 3.9 --only-binary=:all:
+
+    (cd "$out" && zip -q -r -9 "$DIST_DIR/$fn.zip" . -x '*/__pycache__/*')
+    echo "Built $DIST_DIR/$fn.zip"
+done
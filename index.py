@@ -1,9 +1,11 @@
 import json
-import boto3
 import urllib3
 import time
 import urllib.parse
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # --- CONFIGURATION ---
 OS_ENDPOINT = os.environ.get('OS_ENDPOINT', '')
@@ -12,51 +14,167 @@ OS_PASS = os.environ.get('OS_PASS', '')
 BOT_ID = os.environ.get('BOT_ID', '')
 BOT_ALIAS_ID = os.environ.get('BOT_ALIAS_ID', '')
 TARGET_BUCKET_NAME = os.environ.get('TARGET_BUCKET_NAME', '')
+LOG_EVENTS = os.environ.get('LOG_LEVEL', 'INFO').upper() == 'DEBUG'
+CUSTOM_LABELS_SKIP_REKOGNITION = int(os.environ.get('CUSTOM_LABELS_SKIP_REKOGNITION', '0'))  # 0 disables
+HONOR_SKIP_REKOG_HEADER = os.environ.get('HONOR_SKIP_REKOG_HEADER', 'false').lower() == 'true'
+# Only when a skip is possible does Rekognition have to wait for the metadata
+REKOGNITION_SKIPPABLE = CUSTOM_LABELS_SKIP_REKOGNITION > 0 or HONOR_SKIP_REKOG_HEADER
+STOPWORDS = frozenset({'the', 'a', 'an', 'of', 'in', 'on', 'with', 'and'})
 # ---------------------
 
+# --- AWS CLIENTS (created on first use per branch, reused across warm invocations) ---
+# The indexing path never loads the Lex service model and the search path never
+# loads S3/Rekognition, which keeps cold starts for each route lean.
+_clients = {}
+# Larger keep-alive pool so fan-out and warm invocations reuse sockets
+BOTO_CONFIG = {'max_pool_connections': 50, 'retries': {'max_attempts': 3, 'mode': 'adaptive'}, 'tcp_keepalive': True}
+
+def _client(name):
+    if name not in _clients:
+        import boto3
+        from botocore.config import Config
+        _clients[name] = boto3.client(name, config=Config(**BOTO_CONFIG))
+    return _clients[name]
+
+# --- HTTP POOL (keep-alive connections to OpenSearch across invocations) ---
+HTTP = urllib3.PoolManager(
+    maxsize=10,
+    retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504])
+)
+
+# --- OPENSEARCH REQUEST CONSTANTS (computed once at import) ---
+_ENDPOINT = OS_ENDPOINT.replace('https://', '').rstrip('/')
+BULK_URL = f"https://{_ENDPOINT}/photos/_bulk"
+SEARCH_URL = f"https://{_ENDPOINT}/photos/_search"
+AUTH_HEADERS = urllib3.make_headers(basic_auth=f"{OS_USER}:{OS_PASS}")
+NDJSON_HEADERS = {**AUTH_HEADERS, 'Content-Type': 'application/x-ndjson'}
+# Filter by bucket inside OpenSearch so fewer hits come back over the wire. A quoted
+# value works whether bucket is mapped as text (phrase match) or keyword (exact match).
+BUCKET_FILTER = f' AND bucket:"{TARGET_BUCKET_NAME}"' if TARGET_BUCKET_NAME else ''
+
+# Lookups run on workers so they overlap within a record and across a batched event
+EXEC = ThreadPoolExecutor(max_workers=4)
+
+@lru_cache(maxsize=1024)
+def classify_query(q):
+    # Cached per warm container; a fresh session per miss avoids slot carryover between users
+    return _client('lexv2-runtime').recognize_text(botId=BOT_ID, botAliasId=BOT_ALIAS_ID, localeId='en_US', sessionId=uuid.uuid4().hex, text=q)
+
 def lambda_handler(event, context):
-    print("Event received:", json.dumps(event))
+    # Dumping the whole event is multi-KB per invoke; only do it when debugging
+    if LOG_EVENTS:
+        print("Event received:", json.dumps(event))
     
     # ROUTER: Determine if we are Indexing (S3 Event) or Searching (API Gateway Event)
-    if 'Records' in event:
+    if event.get('warmup'):
+        return handle_warmup()
+    elif 'Records' in event:
         return handle_indexing(event)
     elif 'queryStringParameters' in event:
         return handle_search(event)
     else:
         return {'statusCode': 400, 'body': json.dumps('Unknown Event Type')}
 
+# --- WARM-UP (scheduled EventBridge ping) ---
+def handle_warmup():
+    # Build the search client and open a pooled TLS connection to OpenSearch so the
+    # next real search only does I/O
+    try:
+        _client('lexv2-runtime')
+        HTTP.request('HEAD', f"https://{_ENDPOINT}/", headers=AUTH_HEADERS, retries=False)
+    except Exception as e:
+        print(f"Warm-up Error: {e}")
+    return {'statusCode': 200, 'body': 'Warm'}
+
 # --- LOGIC 1: INDEXING (LF1) ---
-def handle_indexing(event):
-    http = urllib3.PoolManager()
-    s3 = boto3.client('s3')
-    rekognition = boto3.client('rekognition')
+def _parse_meta(meta):
+    # Returns the custom labels and whether Rekognition can be skipped (the uploader
+    # opted out or supplied enough labels)
+    custom = meta.get('customlabels', '')
+    custom = [x.strip() for x in custom.split(',')] if custom else []
+    skip = (HONOR_SKIP_REKOG_HEADER and meta.get('skiprekog') == '1') or bool(CUSTOM_LABELS_SKIP_REKOGNITION and len(custom) >= CUSTOM_LABELS_SKIP_REKOGNITION)
+    return custom, skip
+
+def _lookup_labels(s3, rekognition, bucket, key, meta):
+    # Metadata first, so Rekognition is only called when the custom labels aren't enough
+    if meta is None:
+        meta = s3.head_object(Bucket=bucket, Key=key).get('Metadata', {})
+    custom, skip = _parse_meta(meta)
+    if skip:
+        return custom
+    rekog = rekognition.detect_labels(Image={'S3Object': {'Bucket': bucket, 'Name': key}}, MaxLabels=10)
+    return [l['Name'] for l in rekog['Labels']] + custom
+
+def _submit_lookups(s3, rekognition, bucket, key, meta):
+    # Returns a callable that waits for the record's labels
+    if REKOGNITION_SKIPPABLE:
+        return EXEC.submit(_lookup_labels, s3, rekognition, bucket, key, meta).result
     
+    # Nothing can skip Rekognition, so run head_object and detect_labels side by side
+    f_head = None if meta is not None else EXEC.submit(s3.head_object, Bucket=bucket, Key=key)
+    f_rek = EXEC.submit(rekognition.detect_labels, Image={'S3Object': {'Bucket': bucket, 'Name': key}}, MaxLabels=10)
+    def collect():
+        custom, _ = _parse_meta(meta if f_head is None else f_head.result().get('Metadata', {}))
+        return [l['Name'] for l in f_rek.result()['Labels']] + custom
+    return collect
+
+def handle_indexing(event):
     try:
-        record = event['Records'][0]['s3']
-        bucket = record['bucket']['name']
-        key = urllib.parse.unquote_plus(record['object']['key'])
+        s3 = _client('s3')
+        rekognition = _client('rekognition')
         
-        print(f"Indexing Image: {key} from {bucket}")
+        # S3 may batch several records per invocation; index them in one _bulk call
+        pending = []
+        for record in event['Records']:
+            record = record['s3']
+            bucket = record['bucket']['name']
+            key = urllib.parse.unquote_plus(record['object']['key'])
+            
+            print(f"Indexing Image: {key} from {bucket}")
+            
+            # 1. Get Metadata / 2. Detect Labels (fanned out across all records).
+            # A producer (e.g. an EventBridge input transformer) may inline the user
+            # metadata as s3.object.metadata, in which case head_object is skipped.
+            inline_meta = record['object'].get('metadata')
+            if inline_meta is not None:
+                custom, skip = _parse_meta(inline_meta)
+                if skip:
+                    # Nothing left to look up, so don't schedule any work for this record
+                    pending.append((bucket, key, None, custom))
+                    continue
+            pending.append((bucket, key, _submit_lookups(s3, rekognition, bucket, key, inline_meta), None))
         
-        # 1. Detect Labels
-        rekog = rekognition.detect_labels(Image={'S3Object': {'Bucket': bucket, 'Name': key}}, MaxLabels=10)
-        labels = [l['Name'] for l in rekog['Labels']]
+        lines = []
+        failed = 0
+        for bucket, key, collect, labels in pending:
+            if collect is not None:
+                try:
+                    labels = collect()
+                except Exception as e:
+                    # One bad image (e.g. InvalidImageFormatException) shouldn't drop the rest of the batch
+                    print(f"Indexing Error for {key}: {e}")
+                    failed += 1
+                    continue
+            doc = {"objectKey": key, "bucket": bucket, "createdTimestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()), "labels": labels}
+            # Key-derived id so re-uploading the same key updates the existing document
+            lines.append(json.dumps({"index": {"_id": key.replace('/', '_')}}))
+            lines.append(json.dumps(doc))
         
-        # 2. Get Metadata
-        meta = s3.head_object(Bucket=bucket, Key=key)
-        custom = meta.get('Metadata', {}).get('customlabels', '')
-        if custom: labels.extend([x.strip() for x in custom.split(',')])
+        if not lines:
+            return {'statusCode': 500, 'body': 'No photos could be indexed'}
         
         # 3. Index to OpenSearch
-        doc = {"objectKey": key, "bucket": bucket, "createdTimestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()), "labels": labels}
-        
-        endpoint = OS_ENDPOINT.replace('https://', '').replace('/', '')
-        url = f"https://{endpoint}/photos/_doc"
-        auth = urllib3.make_headers(basic_auth=f"{OS_USER}:{OS_PASS}")
-        headers = {'Content-Type': 'application/json'}
-        headers.update(auth)
-        
-        http.request('POST', url, body=json.dumps(doc).encode('utf-8'), headers=headers)
+        # The _bulk body is newline-delimited JSON and must end with a newline
+        resp = HTTP.request('POST', BULK_URL, body=('\n'.join(lines) + '\n').encode('utf-8'), headers=NDJSON_HEADERS)
+        # A request-level failure (auth, bad mapping) has no per-item 'errors' flag
+        if resp.status >= 300:
+            print(f"Bulk Indexing Failed ({resp.status}): {resp.data}")
+            return {'statusCode': 500, 'body': f'Bulk indexing failed with status {resp.status}'}
+        if json.loads(resp.data.decode('utf-8')).get('errors'):
+            print(f"Bulk Indexing Errors: {resp.data}")
+            return {'statusCode': 500, 'body': 'Bulk indexing reported errors'}
+        if failed:
+            return {'statusCode': 500, 'body': f'Failed to index {failed} of {len(pending)} photo(s)'}
         return {'statusCode': 200, 'body': 'Indexed'}
     except Exception as e:
         print(f"Indexing Error: {e}")
@@ -64,7 +182,6 @@ def handle_indexing(event):
 
 # --- LOGIC 2: SEARCH (LF2) ---
 def handle_search(event):
-    http = urllib3.PoolManager()
     headers = {
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
@@ -72,46 +189,41 @@ def handle_search(event):
     }
     
     try:
-        q = event.get('queryStringParameters', {}).get('q', 'dogs')
+        q = (event.get('queryStringParameters') or {}).get('q', '')
         print(f"Search Query: {q}")
         
+        # Nothing to search for: skip Lex and OpenSearch entirely
+        if not q.strip():
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps([])}
+        
         # 1. Lex Disambiguation
-        client = boto3.client('lexv2-runtime')
-        lex_resp = client.recognize_text(botId=BOT_ID, botAliasId=BOT_ALIAS_ID, localeId='en_US', sessionId='test', text=q)
+        lex_resp = classify_query(q.strip().lower())
         slots = lex_resp.get('sessionState', {}).get('intent', {}).get('slots', {})
         keyword = q
         if slots and slots.get('keywords') and slots['keywords'].get('value'):
             keyword = slots['keywords']['value']['originalValue']
+        if set(keyword.lower().split()) <= STOPWORDS:
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps([])}
             
         # 2. Search OpenSearch
-        endpoint = OS_ENDPOINT.replace('https://', '').replace('/', '')
-        url = f"https://{endpoint}/photos/_search?q=labels:{keyword}"
-        auth = urllib3.make_headers(basic_auth=f"{OS_USER}:{OS_PASS}")
-        
-        resp = http.request('GET', url, headers=auth)
+        resp = HTTP.request('GET', SEARCH_URL, fields={'q': f"labels:({keyword}){BUCKET_FILTER}"}, headers=AUTH_HEADERS)
         data = json.loads(resp.data.decode('utf-8'))
         
-        results = []
-        unique_urls = set()
-        
-        if 'hits' in data:
-            for hit in data['hits']['hits']:
-                src = hit['_source']
-                bucket = src.get('bucket')
-                key = src.get('objectKey')
-                
-                # Filter Logic
-                if TARGET_BUCKET_NAME and bucket != TARGET_BUCKET_NAME:
-                    continue
-                
-                img_url = f"https://{bucket}.s3.amazonaws.com/{key}"
-                if img_url in unique_urls:
-                    continue
-                
-                unique_urls.add(img_url)
-                results.append({"url": img_url, "labels": src['labels']})
+        # Keyed by URL so duplicates collapse in one pass, keeping the first hit
+        results = {}
+        for hit in data.get('hits', {}).get('hits', []):
+            src = hit['_source']
+            bucket = src.get('bucket')
+            key = src.get('objectKey')
+            
+            # Filter Logic
+            if TARGET_BUCKET_NAME and bucket != TARGET_BUCKET_NAME:
+                continue
+            
+            img_url = f"https://{bucket}.s3.amazonaws.com/{key}"
+            results.setdefault(img_url, {"url": img_url, "labels": src['labels']})
         
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(results)}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(list(results.values()))}
     except Exception as e:
         print(f"Search Error: {e}")
         return {'statusCode': 500, 'headers': headers, 'body': json.dumps({"error": str(e)})}
\ No newline at end of file